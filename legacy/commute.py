@@ -20,25 +20,30 @@ kind over another...
 """
 
 from collections import defaultdict, namedtuple
-import fileinput
-import functools
+from dataclasses import dataclass
+import bisect
 import datetime
-import re
+import functools
+import heapq
+import itertools
+import sys
 
 class CommuteGraph:
     def __init__(self, lines):
         """Constructs a new CommuteGraph by parsing the supplied entries."""
         self.edges = defaultdict(list)
 
-        entries = [parse(line) for line in lines]
-        entries = [l for l in entries if l is not None]
+        # find_path() results, by (start, dest).
+        self._found_paths = {}
+
+        entries = [l for l in map(parse, lines) if l is not None]
 
         # Scan ahead until we find the header.
         for i in range(0, len(entries)):
             e = entries[i]
-            if isinstance(e, Header):
+            if e.KIND == HEADER:
                 break
-            if isinstance(e, FlexRoute) or isinstance(e, TimedRoute):
+            if e.KIND == FLEX or e.KIND == TIMED:
                 raise Exception("Routes appearing before header")
 
         # There must be a header.
@@ -50,116 +55,244 @@ class CommuteGraph:
 
         # Build the graph.
         for e in entries[i+1:]:
-            if isinstance(e, FlexRoute):
+            if e.KIND == FLEX:
                 self.edges[e.start].append(e)
                 self.edges[e.dest].append(e.reversed())
-            elif isinstance(e, TimedRoute):
+            elif e.KIND == TIMED:
                 self.edges[e.start].append(e)
-            elif isinstance(e, Header):
+            elif e.KIND == HEADER:
                 raise Exception("Duplicate header")
             else:
                 raise Exception("Unexpected entry type {0}".format(e.__class__))
 
-        # Lastly, sort the routes according to priority.
+        # Lastly, sort the routes according to priority: flex routes, shortest
+        # first, then timed routes, earliest first.
         for k, v in self.edges.items():
-            v.sort()
+            v.sort(key=route_key)
+
+        # Lay the graph out in CSR form for the DFS: nodes are numbered, and the
+        # routes leaving node u are routes[indptr[u]:indptr[u+1]], with the ids of
+        # their dests alongside in route_dest.  The timed routes leaving u start at
+        # timed_ptr[u], and route_start holds their start times for bisecting.
+        nodes = set(self.edges) | {self.start, self.dest}
+        nodes.update(e.dest for v in self.edges.values() for e in v)
+        self.node_id = {name: i for i, name in enumerate(sorted(nodes))}
+        self.indptr = [0]
+        self.routes = []
+        self.route_dest = []
+        self.route_start = []
+        self.timed_ptr = []
+        for name in sorted(nodes):
+            v = self.edges.get(name, ())
+            self.timed_ptr.append(len(self.routes) + sum(1 for e in v if e.KIND == FLEX))
+            for e in v:
+                self.routes.append(e)
+                self.route_dest.append(self.node_id[e.dest])
+                self.route_start.append(e.start_time if e.KIND == TIMED else None)
+            self.indptr.append(len(self.routes))
 
 
     def find_path(self, start, dest):
         """traverses the commute graph and finds the paths that exist from start
         to dest, with the "don't get on routes that have already departed"
-        timing constraint. """
-        def dfs_unconstrained(curr, dest, seen, acc):
-            """Does a DFS from curr to dest.  In this state we have not encountered
-            any timed routes, so our accumulator is simply the vertices we've traversed
-            along those flex state edges.  If we encounter a timed state, we have to
-            transition to recursing with dfs_constrained()."""
-            new_seen = seen.copy()
-            new_seen.add(curr)
+        timing constraint.  Returns a tuple of paths, each a tuple of routes; the
+        result is cached, so repeated queries for the same trip are free."""
+        if (start, dest) not in self._found_paths:
+            self._found_paths[start, dest] = self._find_path(start, dest)
+        return self._found_paths[start, dest]
+
+    def _find_path(self, start, dest):
+        if start not in self.node_id or dest not in self.node_id:
+            return ()
+        start = self.node_id[start]
+        dest = self.node_id[dest]
+        indptr, routes, route_dest = self.indptr, self.routes, self.route_dest
+        timed_ptr, route_start = self.timed_ptr, self.route_start
+        # Memoized sub-searches, see dfs_unconstrained().  Each search starts
+        # afresh, so this never holds more than one search's worth of paths.
+        self._path_cache = {}
+
+        def dfs_unconstrained(curr, seen):
+            """Does a DFS from curr to dest, returning the paths found as tuples of
+            routes.  In this state we have not encountered any timed routes, so the
+            flex routes we traverse can't be pinned to a time yet; they are returned
+            as-is and promoted once the first timed route along the path is known.  If
+            we encounter a timed state, we have to transition to recursing with
+            dfs_constrained().
+
+            seen is a bitmask of the node ids on the path so far.  The paths from
+            curr depend only on curr and seen, so results are memoized on those."""
+            key = (curr, seen)
+            if key in self._path_cache:
+                return self._path_cache[key]
+            paths = []
             if curr == dest:
-                yield acc
-            if curr not in seen:
-                for e in self.edges[curr]:
-                    if isinstance(e, FlexRoute):
-                        yield from dfs_unconstrained(e.dest, dest, new_seen, acc + [e])
-                    elif isinstance(e, TimedRoute):
-                        ts = e.start_time
-                        new_acc = []
-                        for i in reversed(list(range(0, len(acc)))):
-                            to_promote = acc[i]
-                            if isinstance(to_promote, FlexRoute):
-                                promoted = to_promote.promote(end_ts = ts)
-                                new_acc = [promoted] + new_acc
-                                ts = promoted.start_time
-                        yield from dfs_constrained(e.dest, dest, new_seen, new_acc + [e], e.dest_time)
-
-        def dfs_constrained(curr, dest, seen, acc, ts):
-            """Does a DFS from curr to dest, accumulating the current path as we go,
-            with the additional accumulator representing the current timestamp; we also
-            enforce the invariant that that no valid path will begin at a timestamp
-            prior to the supplied one."""
-            new_seen = seen.copy()
-            new_seen.add(curr)
+                paths.append(())
+            if not (seen >> curr) & 1:
+                seen |= 1 << curr
+                for j in range(indptr[curr], indptr[curr+1]):
+                    e = routes[j]
+                    if e.KIND == FLEX:
+                        paths.extend((e,) + p for p in dfs_unconstrained(route_dest[j], seen))
+                    elif e.KIND == TIMED:
+                        paths.extend((e,) + p for p in dfs_constrained(route_dest[j], seen, e.dest_time))
+            self._path_cache[key] = paths
+            return paths
+
+        def dfs_constrained(curr, seen, ts):
+            """Does a DFS from curr to dest, with the additional accumulator
+            representing the current timestamp; we also enforce the invariant that
+            that no valid path will begin at a timestamp prior to the supplied one.
+            Memoized as in dfs_unconstrained(), with ts as part of the key."""
+            key = (curr, ts, seen)
+            if key in self._path_cache:
+                return self._path_cache[key]
+            paths = []
             if curr == dest:
-                yield acc
-            if curr not in seen:
-                for e in self.edges[curr]:
-                    if isinstance(e, TimedRoute) and e.start_time >= ts:
-                        yield from dfs_constrained(e.dest, dest, new_seen, acc + [e], e.dest_time)
-                    elif isinstance(e, FlexRoute):
-                        e = e.promote(begin_ts=ts)
-                        yield from dfs_constrained(e.dest, dest, new_seen, acc + [e], e.dest_time)
-
+                paths.append(())
+            if not (seen >> curr) & 1:
+                seen |= 1 << curr
+                for j in range(indptr[curr], timed_ptr[curr]):
+                    e = routes[j].promote(begin_ts=ts)
+                    paths.extend((e,) + p for p in dfs_constrained(route_dest[j], seen, e.dest_time))
+                # Skip straight past the timed routes that have already departed.
+                hi = indptr[curr+1]
+                for j in range(bisect.bisect_left(route_start, ts, timed_ptr[curr], hi), hi):
+                    e = routes[j]
+                    paths.extend((e,) + p for p in dfs_constrained(route_dest[j], seen, e.dest_time))
+            self._path_cache[key] = paths
+            return paths
+
+        return tuple(promote_leading(path) for path in dfs_unconstrained(start, 0))
+
+    def shortest_path(self, start, dest, ts):
+        """finds the path from start to dest that arrives earliest, leaving start
+        no earlier than ts.  Unlike find_path() this doesn't enumerate every path:
+        it is a Dijkstra over the nodes, keyed by the time we reach them, which is
+        sound since taking a route later never gets us anywhere sooner.  Flex routes
+        are taken as soon as we arrive.  Returns the path as a tuple of routes, as
+        find_path() does; that's () when start is dest, and None if dest can't
+        be reached or either node isn't in the graph."""
+        if start not in self.node_id or dest not in self.node_id:
+            return None
+        start = self.node_id[start]
+        dest = self.node_id[dest]
+        indptr, routes, route_dest = self.indptr, self.routes, self.route_dest
+
+        ts = validateTime(ts)
+        best_time = [None] * len(self.node_id)
+        best_time[start] = ts
+        # The counter breaks ties so that heapq never compares paths.
+        tiebreak = itertools.count()
+        heap = [(ts, next(tiebreak), start, ())]
+        while heap:
+            t, _, curr, path = heapq.heappop(heap)
+            if curr == dest:
+                return path
+            if t > best_time[curr]:
+                continue
+            for j in range(indptr[curr], indptr[curr+1]):
+                e = routes[j]
+                if e.KIND == FLEX:
+                    # Times don't wrap past midnight, so neither can the trip.
+                    if t + e.duration >= 24 * 60:
+                        continue
+                    e = e.promote(begin_ts=t)
+                elif e.start_time < t:
+                    continue
+                v = route_dest[j]
+                if best_time[v] is None or e.dest_time < best_time[v]:
+                    best_time[v] = e.dest_time
+                    heapq.heappush(heap, (e.dest_time, next(tiebreak), v, path + (e,)))
+        return None
 
-        yield from dfs_unconstrained(start, dest, set(), list())
 
+def promote_leading(path):
+    """Promotes the flex routes at the front of path, which were traversed before
+    any timed route, so that they end just as the first timed route departs.
+    Paths made up entirely of flex routes are returned unchanged."""
+    for i, e in enumerate(path):
+        if e.KIND == TIMED:
+            break
+    else:
+        return tuple(path)
+
+    # Walk backwards from the timed route, collecting in reverse and flipping
+    # once at the end rather than prepending each time.
+    ts = path[i].start_time
+    new_acc = []
+    for to_promote in reversed(path[:i]):
+        promoted = to_promote.promote(end_ts = ts)
+        new_acc.append(promoted)
+        ts = promoted.start_time
+    new_acc.reverse()
+    return tuple(new_acc) + path[i:]
 
 #############################################################################
 # Input parsing
 #############################################################################
 
+# The tokens of the grammar.  Lines are fixed-arity and whitespace-separated, so
+# parse() splits them and checks each token with is_word() and friends rather
+# than matching these; they're kept as the reference for what those accept.
 word_pat = '(\w+)'
 time_pat = '(\d?\d:\d{2})'
 dur_pat = '(\d+)'
-header_re = re.compile('(\w+)\s+(\w+)')
-flex_re = re.compile("f {0}\s+{1}\s+{2}\s*".format(word_pat, word_pat, dur_pat))
-timed_re = re.compile("t {0}\s+{1}\s+{2}\s+{3}\s*".format(word_pat, time_pat, word_pat, time_pat))
-comment_re = re.compile("#\s*(.*)")
 
-def route_le(a,b):
-    """Returns the route with the greatest "priority", which we define as follows:
+# Entry kinds, tagged on each class as KIND; comparing these is cheaper than an
+# isinstance() check in the DFS.
+FLEX, TIMED, HEADER = range(3)
+
+def route_lt(a,b):
+    """Returns whether a has greater "priority" than b, which we define as follows:
       - Always prefer flexibile routes over timed routes
       - Prefer shorter flex routes over longer ones
       - Prefer timed routes that leave earler than ones that leave later.
     """
-    if (isinstance(a, FlexRoute) and isinstance(b, FlexRoute)):
+    if a.KIND != b.KIND:
+        return a.KIND == FLEX
+    if a.KIND == FLEX:
         return a.duration < b.duration
-    if (isinstance(a, FlexRoute) and isinstance(b, TimedRoute)):
-        return True
-    if (isinstance(a, TimedRoute) and isinstance(b, FlexRoute)):
-        return False
-    return a.start < b.start
-
-@functools.total_ordering
+    return a.start_time < b.start_time
+
+def route_key(r):
+    """A sort key that orders routes the same way route_lt() does.  Sorting with
+    it calls this once per route, rather than route_lt() once per comparison."""
+    if r.KIND == FLEX:
+        return (FLEX, r.duration)
+    return (TIMED, r.start_time)
+
+def restore_route(route, state):
+    """Unpickles a route's fields, as listed in its __slots__.  They were
+    validated when the route was first built, so unlike __post_init__ this only
+    re-interns the names."""
+    for name, value in zip(route.__slots__, state):
+        if isinstance(value, str):
+            value = sys.intern(value)
+        object.__setattr__(route, name, value)
+
+@dataclass(frozen=True, slots=True, repr=False)
 class FlexRoute:
     """A flexible route for the commute graph.  A FlexRoute is an edge
     that can be processed at any time.  For instance, cycling from my house
     to the train might take 15 minutes, but I can do so at any point."""
-    def __init__(self, start, dest, duration):
-        self.start = start
-        self.dest = dest
-        self.duration = validateDuration(duration)
+    KIND = FLEX
+
+    start: str
+    dest: str
+    duration: int
 
-    def __eq__(self, other):
-        if not isinstance(other, self.__class__):
-            return False
-        return self.start == other.start and self.dest == other.dest and self.duration == other.duration
+    def __post_init__(self):
+        # Routes are frozen, so normalizing the fields has to bypass __setattr__.
+        object.__setattr__(self, "start", sys.intern(self.start))
+        object.__setattr__(self, "dest", sys.intern(self.dest))
+        object.__setattr__(self, "duration", validateDuration(self.duration))
 
-    def __ne__(self, other):
-        return not self.__eq__(other)
+    def __lt__(self, other):
+        return route_lt(self, other)
 
-    def __le__(self, other):
-        return route_le(self, other)
+    def __setstate__(self, state):
+        restore_route(self, state)
 
     def __repr__(self):
         return "FlexRoute({0}, {1}, {2})".format(self.start, self.dest, self.duration)
@@ -177,90 +310,149 @@ class FlexRoute:
         if begin_ts != None and end_ts != None:
             raise Exception("Both begin_ts and end_ts were set!")
         if begin_ts != None:
-            later = (datetime.datetime.combine(datetime.date.today(), begin_ts) + self.duration).time()
-            return TimedRoute(self.start, begin_ts, self.dest, later)
+            begin_ts = validateTime(begin_ts)
+            return TimedRoute(self.start, begin_ts, self.dest, begin_ts + self.duration)
         if end_ts != None:
-            earlier = (datetime.datetime.combine(datetime.date.today(), end_ts) - self.duration).time()
-            return TimedRoute(self.start, earlier, self.dest, end_ts)
+            end_ts = validateTime(end_ts)
+            return TimedRoute(self.start, end_ts - self.duration, self.dest, end_ts)
 
-@functools.total_ordering
+@dataclass(frozen=True, slots=True, repr=False)
 class TimedRoute:
     """A timed route to the commute graph.  A timed route is an edge
     that can only be processed at or after the current time."""
-    def __init__(self, start, start_time, dest, dest_time):
-        self.start = start
-        self.start_time = validateTime(start_time)
-        self.dest = dest
-        self.dest_time = validateTime(dest_time)
+    KIND = TIMED
+
+    start: str
+    start_time: int
+    dest: str
+    dest_time: int
+
+    def __post_init__(self):
+        object.__setattr__(self, "start", sys.intern(self.start))
+        object.__setattr__(self, "start_time", validateTime(self.start_time))
+        object.__setattr__(self, "dest", sys.intern(self.dest))
+        object.__setattr__(self, "dest_time", validateTime(self.dest_time))
 
         if self.start_time >= self.dest_time:
             raise Exception("Start time must be before dest time!")
 
-    def __eq__(self, other):
-        if not isinstance(other, self.__class__):
-            return False
-        return self.start == other.start and self.dest == other.dest and self.start_time == other.start_time and self.dest_time == other.dest_time
+    def __lt__(self, other):
+        return route_lt(self, other)
 
-    def __ne__(self, other):
-        return not self.__eq__(other)
-
-    def __le__(self, other):
-        return route_le(self, other)
+    def __setstate__(self, state):
+        restore_route(self, state)
 
     def __repr__(self):
-        return "TimedRoute({0}, {1}, {2}, {3})".format(self.start, self.start_time, self.dest, self.dest_time)
+        return "TimedRoute({0}, {1}, {2}, {3})".format(self.start, formatTime(self.start_time), self.dest, formatTime(self.dest_time))
 
-Header = namedtuple('Header', ['start', 'dest'])
+class Header(namedtuple('Header', ['start', 'dest'])):
+    __slots__ = ()
+    KIND = HEADER
 
-def parse(line):
-    m = re.match(flex_re, line)
-    if m is not None:
-        return FlexRoute(m.group(1), m.group(2), m.group(3))
+    def __new__(cls, start, dest):
+        return super().__new__(cls, sys.intern(start), sys.intern(dest))
 
-    m = re.match(timed_re, line)
-    if m is not None:
-        return TimedRoute(m.group(1), m.group(2), m.group(3), m.group(4))
+def parse_header(parts):
+    if is_word(parts[0]) and is_word(parts[1]):
+        return Header(parts[0], parts[1])
 
-    m = re.match(header_re, line)
-    if m is not None:
-        return Header(m.group(1), m.group(2))
+def parse_flex(parts):
+    if parts[0] == "f" and is_word(parts[1]) and is_word(parts[2]) and is_duration(parts[3]):
+        return FlexRoute(parts[1], parts[2], parts[3])
 
-    m = re.match(comment_re, line)
-    if m is not None:
-        return None
+def parse_timed(parts):
+    if (parts[0] == "t" and is_word(parts[1]) and is_time(parts[2])
+            and is_word(parts[3]) and is_time(parts[4])):
+        return TimedRoute(parts[1], parts[2], parts[3], parts[4])
+
+# Each kind of line has its own number of fields, so that alone picks the one
+# parser that could accept it.  Each returns None if the fields don't check out.
+line_parsers = {2: parse_header, 4: parse_flex, 5: parse_timed}
 
-    if line.isspace():
+# Timetables repeat the same lines often enough that caching pays off; this is
+# safe because routes and headers are immutable.
+@functools.lru_cache(maxsize=4096)
+def parse(line):
+    parts = line.split()
+    if not parts or parts[0].startswith("#"):
         return None
 
-    raise Exception("Syntax error on line \"{1}\"".format(i+1, lines[i]))
+    parser = line_parsers.get(len(parts))
+    entry = parser(parts) if parser is not None else None
+    if entry is None:
+        raise Exception("Syntax error on line \"{0}\"".format(line))
+    return entry
+
+def is_word(tok):
+    """Checks tok against word_pat as if compiled with re.ASCII: only ASCII
+    letters, digits and underscores count, where plain word_pat would also
+    accept Unicode word characters."""
+    return tok.isascii() and tok.replace("_", "a").isalnum()
+
+def is_duration(tok):
+    """Checks tok against dur_pat."""
+    return tok.isascii() and tok.isdigit()
+
+# Every well-formed time of day and the common durations, precomputed so that
+# validating a token is usually a single dict lookup.
+time_table = {"{0}:{1:02d}".format(h, m): h * 60 + m for h in range(24) for m in range(60)}
+time_table.update({"{0:02d}:{1:02d}".format(h, m): h * 60 + m for h in range(10) for m in range(60)})
+duration_table = {str(d): d for d in range(240)}
+
+def is_time(tok):
+    """Checks tok against time_pat, i.e. one or two digits, a colon, then two
+    digits, with straight-line string checks rather than a trip through the
+    regex engine."""
+    return (4 <= len(tok) <= 5 and tok[-3] == ":" and tok.isascii()
+            and tok[:-3].isdigit() and tok[-2:].isdigit())
 
 def validateTime(tok):
-    """Produces a datetime.time from the current token."""
+    """Produces a time of day, in minutes since midnight, from the current token.
+    Times are kept as plain ints so that the DFS can do its arithmetic without
+    allocating datetime objects."""
+    t = time_table.get(tok)
+    if t is not None:
+        return t
     if isinstance(tok, datetime.time):
-        return tok
-    h, m = tok.split(":")
-    return datetime.time(hour=int(h), minute=int(m))
+        return tok.hour * 60 + tok.minute
+    if not isinstance(tok, int):
+        # time_table holds every valid time of day, so tok is malformed or out
+        # of range.
+        raise Exception("Malformed time \"{0}\"".format(tok))
+    if not 0 <= tok < 24 * 60:
+        raise Exception("Time out of range: {0} minutes past midnight".format(tok))
+    return tok
 
 def validateDuration(tok):
-    """Produces a TimeDelta from the current token."""
-    if isinstance(tok, datetime.timedelta):
-        return tok
-    return datetime.timedelta(minutes=int(tok))
+    """Produces a duration, in minutes, from the current token."""
+    d = duration_table.get(tok)
+    if d is not None:
+        return d
+    return int(tok)
+
+def formatTime(t):
+    """Renders minutes since midnight as HH:MM."""
+    return "{0:02d}:{1:02d}".format(*divmod(t, 60))
 
 
 def route_len(l):
     if len(l) == 0:
         return 0
-    b = datetime.datetime.combine(datetime.date.today(), l[-1].dest_time)
-    a = datetime.datetime.combine(datetime.date.today(), l[-0].start_time)
-    return (b-a).seconds
+    return l[-1].dest_time - l[0].start_time
 
 if __name__ == "__main__":
-    lines = list(fileinput.input())
+    # Read each file named on the command line in one go rather than line by
+    # line, or stdin if no files are named.
+    if sys.argv[1:]:
+        lines = []
+        for path in sys.argv[1:]:
+            with open(path) as f:
+                lines.extend(f.read().splitlines())
+    else:
+        lines = sys.stdin.read().splitlines()
     g = CommuteGraph(lines)
-    min_route = []
-    for i, route in enumerate(sorted(list(g.find_path(g.start, g.dest)), key=route_len)):
-        dt = datetime.timedelta(seconds=route_len(route))
+    for route in sorted(g.find_path(g.start, g.dest), key=route_len):
+        dt = datetime.timedelta(minutes=route_len(route))
         vs = " -> ".join([v.dest for v in route])
-        print("{0} for trip starting at {1} with route: {2}".format(dt, route[0].start_time, vs))
-        print(route)
+        print("{0} for trip starting at {1} with route: {2}".format(dt, formatTime(route[0].start_time), vs))
+        print(list(route))
@@ -1,27 +1,40 @@
 import commute
 import datetime
+import pickle
 import re
+import sys
 import unittest
 
 class Tokenizing(unittest.TestCase):
     words = [ ('word', True), ('two words', False) ]
     times = [ ('01:23', True), ('1:23', True), ('11:59', True), ('99:99', True) ]
+    word_re = re.compile(commute.word_pat)
+    time_re = re.compile(commute.time_pat)
 
     def test_word_tokenization(self):
-        r = re.compile("^" + commute.word_pat + "$")
         for token, expected in self.words:
-            actual = re.fullmatch(r, token) is not None
+            actual = self.word_re.fullmatch(token) is not None
             self.assertEqual(expected, actual)
+            self.assertEqual(expected, commute.is_word(token))
+
+    def test_word_is_ascii_only(self):
+        self.assertIsNotNone(self.word_re.fullmatch('caf\u00e9'))
+        self.assertFalse(commute.is_word('caf\u00e9'))
 
     def test_time_tokenization(self):
-        r = re.compile("^" + commute.time_pat + "$")
         for token, expected in self.times:
-            actual = re.match(r, token) is not None
+            actual = self.time_re.fullmatch(token) is not None
             self.assertEqual(expected, actual)
 
+    def test_is_time(self):
+        for token, expected in self.times + [('1:2', False), ('123:45', False), ('ab:cd', False)]:
+            self.assertEqual(expected, commute.is_time(token))
+            self.assertEqual(expected, self.time_re.fullmatch(token) is not None)
+
 class LineParsing(unittest.TestCase):
     values = [
         ("home work", commute.Header("home", "work")),
+        ("transbay_terminal work", commute.Header("transbay_terminal", "work")),
 
         ("# A comment", None),
         ("#abc", None),
@@ -33,8 +46,13 @@ class LineParsing(unittest.TestCase):
 
     def test_line_parsing(self):
         for line, expected in self.values:
-            actual = commute.parse(line)
-            self.assertEqual(actual, expected)
+            with self.subTest(line=line):
+                self.assertEqual(commute.parse(line), expected)
+
+    def test_syntax_error(self):
+        for line in ["f home train", "t home 7:15 work", "home work school", "f home train 1:5"]:
+            with self.subTest(line=line):
+                self.assertRaises(Exception, commute.parse, line)
 
 class DocumentParsing(unittest.TestCase):
     lines = ["# A sample commute from my hometown.",
@@ -44,16 +62,69 @@ class DocumentParsing(unittest.TestCase):
              "t busstop 7:15 legislature 7:50",
              "f legislature macewan 15"]
 
+    @classmethod
+    def setUpClass(cls):
+        # None of the tests mutate the graph, so build it just once.
+        cls.g = commute.CommuteGraph(cls.lines)
+
     def test_multiline_parse(self):
-        g = commute.CommuteGraph(self.lines)
+        g = self.g
         self.assertEqual(len(g.edges), 4)
         self.assertEqual(len(g.edges["home"]), 1) #busstop
         self.assertEqual(len(g.edges["busstop"]), 3) #leg1, leg2, home
         self.assertEqual(len(g.edges["macewan"]), 1) #leg
 
+    def test_pickled_routes_interned(self):
+        for v in self.g.edges.values():
+            for e in v:
+                r = pickle.loads(pickle.dumps(e))
+                self.assertEqual(r, e)
+                self.assertIs(r.start, sys.intern(r.start))
+                self.assertIs(r.dest, sys.intern(r.dest))
+
+    def test_csr_layout(self):
+        g = self.g
+        self.assertEqual(len(g.node_id), 4)
+        self.assertEqual(g.indptr[-1], len(g.routes))
+        busstop = g.node_id["busstop"]
+        self.assertEqual(g.routes[g.indptr[busstop]:g.indptr[busstop+1]], g.edges["busstop"])
+        self.assertEqual(g.timed_ptr[busstop] - g.indptr[busstop], 1) #home
+
     def test_dfs(self):
+        T = commute.TimedRoute
+        self.assertEqual(self.g.find_path("home", "macewan"), (
+            (T("home", "6:55", "busstop", "7:00"), T("busstop", "7:00", "legislature", "7:35"),
+             T("legislature", "7:35", "macewan", "7:50")),
+            (T("home", "7:10", "busstop", "7:15"), T("busstop", "7:15", "legislature", "7:50"),
+             T("legislature", "7:50", "macewan", "8:05")),
+        ))
+
+    def test_dfs_memoized(self):
         g = commute.CommuteGraph(self.lines)
-        #print([list(r) for r in g.find_path("home", "macewan")])
+        g.find_path("home", "macewan")
+        memo = g._path_cache
+        self.assertTrue(memo)
+        # The memo holds the raw paths, with the leading flex route unpromoted.
+        walk = commute.FlexRoute("home", "busstop", "5")
+        self.assertTrue(any(p and p[0] == walk for paths in memo.values() for p in paths))
+        # A repeated query is answered without searching again...
+        g.find_path("home", "macewan")
+        self.assertIs(g._path_cache, memo)
+        # ...while a new one starts a fresh memo.
+        g.find_path("busstop", "macewan")
+        self.assertIsNot(g._path_cache, memo)
+
+    def test_shortest_path(self):
+        g = self.g
+        path = g.shortest_path("home", "macewan", "7:00")
+        self.assertEqual(path[-1], commute.TimedRoute("legislature", "7:50", "macewan", "8:05"))
+        self.assertIsNone(g.shortest_path("home", "macewan", "7:15"))
+        self.assertEqual(g.shortest_path("home", "home", "7:00"), ())
+        self.assertIsNone(g.shortest_path("home", "nowhere", "7:00"))
+
+    def test_shortest_path_past_midnight(self):
+        g = commute.CommuteGraph(["a c", "t a 23:30 b 23:50", "f b c 15"])
+        self.assertIsNone(g.shortest_path("a", "c", "23:00"))
 
 class FlexRoutePromoting(unittest.TestCase):
     f = commute.FlexRoute("home", "bart", "15")
@@ -65,18 +136,38 @@ class FlexRoutePromoting(unittest.TestCase):
         t = self.f.promote(end_ts=self.ts)
         self.assertEqual(t, commute.TimedRoute("home", "11:45", "bart", "12:00"))
 
+class TimeValidation(unittest.TestCase):
+    def test_out_of_range_times(self):
+        for tok in ["7:75", "24:30", "99:99", "9:9", -20, 24 * 60]:
+            with self.subTest(tok=tok):
+                self.assertRaises(Exception, commute.validateTime, tok)
+
+    def test_promote_before_midnight(self):
+        f = commute.FlexRoute("a", "b", "30")
+        self.assertRaises(Exception, f.promote, end_ts="0:10")
+
 class RoutePrioritization(unittest.TestCase):
+    def assertSorted(self, l):
+        self.assertEqual(l, sorted(l))
+        self.assertEqual(l, sorted(l, key=commute.route_key))
+
     def test_flexroute_prio(self):
         l = [commute.FlexRoute("home", "bart", "15"), commute.FlexRoute("home", "ferry", "25")]
-        self.assertEqual(l, sorted(l))
+        self.assertSorted(l)
 
     def test_timedroute_prio(self):
         l = [commute.TimedRoute("north_berkeley", "7:15", "millbrae", "8:11"), commute.TimedRoute("north_berkeley", "8:15", "millbrae", "9:11")]
-        self.assertEqual(l, sorted(l))
+        self.assertSorted(l)
+
+    def test_timedroute_prio_by_time(self):
+        l = [commute.TimedRoute("millbrae", "9:00", "north_berkeley", "9:56"), commute.TimedRoute("home", "10:00", "work", "10:30")]
+        self.assertSorted(l)
+        self.assertEqual(l, sorted(reversed(l)))
+        self.assertEqual(l, sorted(reversed(l), key=commute.route_key))
 
     def test_mixed_prio(self):
         l = [commute.FlexRoute("home", "bart", "15"), commute.TimedRoute("north_berkeley", "7:15", "millbrae", "8:11")]
-        self.assertEqual(l, sorted(l))
+        self.assertSorted(l)
 
 
 if __name__ == "__main__":